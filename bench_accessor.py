@@ -0,0 +1,49 @@
+import timeit
+import uuid
+
+from client import Client
+from transport import Response, Transport, PLACEHOLDER_TOKEN
+import ucjson
+
+# Compares the Python-side cost of ExecuteAccessor with a prepared accessor handle. The client
+# runs on a stub transport that returns canned responses, so only the SDK's own work (building
+# and encoding the body, headers, parsing the response) is measured.
+#
+#   python bench_accessor.py
+
+N = 20000
+
+
+class _StubTransport(Transport):
+    token = Response(200, ucjson.dumps({"access_token": PLACEHOLDER_TOKEN}))
+    value = Response(200, '{"value": ["XXX-XXX-7890", "<home address hidden>"]}')
+
+    def request(self, method, url, headers=None, params=None, data=None, timeout=None):
+        return self.token if url.endswith("/oidc/token") else self.value
+
+
+def main():
+    c = Client(
+        "https://example.userclouds.tools", "id", "secret", transport=_StubTransport()
+    )
+
+    accessor_id = uuid.uuid4()
+    context = {"purpose": "support", "team": "tier-1", "ticket": {"id": 12345}}
+    selector = [str(uuid.uuid4())]
+    prepared = c.prepare_accessor(accessor_id, context)
+
+    unprepared = min(
+        timeit.repeat(
+            lambda: c.ExecuteAccessor(accessor_id, context, selector),
+            number=N,
+            repeat=5,
+        )
+    )
+    handle = min(timeit.repeat(lambda: prepared(selector), number=N, repeat=5))
+
+    print(f"ExecuteAccessor:   {unprepared / N * 1e6:.2f}us/call")
+    print(f"prepared accessor: {handle / N * 1e6:.2f}us/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import os
+import re
+import subprocess
+import sys
+
+# Measures the cold import cost of the SDK with `python -X importtime`. requests and iso8601 are
+# only loaded on first use, and PyJWT is no longer used, so none of them should show up in the
+# import of client.py. For comparison, the baseline imports them eagerly alongside the SDK, as
+# client.py and models.py used to.
+#
+#   python bench_import.py
+
+MODULES = ["client", "models", "ucjson", "constants"]
+HEAVY = ["requests", "iso8601", "jwt", "cryptography"]
+EAGER = ["requests", "iso8601", "jwt"]
+RUNS = 5
+
+
+# Cumulative import time in us of every module imported by `statement`
+def importtime(statement: str) -> dict[str, int]:
+    r = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if r.returncode != 0:
+        raise RuntimeError(r.stderr)
+
+    # each line looks like "import time:  self [us] | cumulative | imported package"
+    times = {}
+    for line in r.stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(\s*)(\S+)", line)
+        if m:
+            times[m.group(4)] = int(m.group(2))
+    return times
+
+
+# Best-of-RUNS time (in us) to import `modules` in order, in a fresh interpreter
+def total(modules: list[str]) -> int:
+    statement = f"import {', '.join(modules)}"
+    return min(
+        sum(importtime(statement).get(m, 0) for m in modules) for _ in range(RUNS)
+    )
+
+
+def installed(module: str) -> bool:
+    try:
+        importtime(f"import {module}")
+    except RuntimeError:
+        return False
+    return True
+
+
+def main():
+    for module in MODULES:
+        times = importtime(f"import {module}")
+        loaded = [h for h in HEAVY if h in times]
+        print(
+            f"{module}: {times.get(module, 0) / 1000:.2f}ms cumulative, "
+            f"heavy deps loaded: {loaded or 'none'}"
+        )
+
+    eager = [m for m in EAGER if installed(m)]
+    missing = [m for m in EAGER if m not in eager]
+    lazy = total(["client"])
+    baseline = total(eager + ["client"])
+    print(f"import client, lazy:  {lazy / 1000:.2f}ms")
+    print(
+        f"import client, eager: {baseline / 1000:.2f}ms "
+        f"(with {', '.join(eager) or 'nothing'}"
+        + (f"; not installed: {', '.join(missing)})" if missing else ")")
+    )
+
+
+if __name__ == "__main__":
+    main()
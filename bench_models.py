@@ -0,0 +1,58 @@
+import time
+import timeit
+import uuid
+
+from models import UserResponse, parse_uuids
+
+# Compares decoding a page of users one row at a time with the batch path used by
+# ListUsers_AdminOnly.
+#
+#   python bench_models.py
+
+ROWS = 10000
+
+
+def _page(n: int) -> list[dict]:
+    now = int(time.time())
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "updated_at": now - i,
+            "profile": {
+                "email": f"user{i}@example.org",
+                "email_verified": True,
+                "name": f"User {i}",
+                "nickname": f"user{i}",
+                "picture": "",
+            },
+            "require_mfa": False,
+            "profile_ext": {},
+            "authns": [],
+        }
+        for i in range(n)
+    ]
+
+
+def _best(f) -> float:
+    return min(timeit.repeat(f, number=1, repeat=10))
+
+
+def main():
+    page = _page(ROWS)
+    ids = [j["id"] for j in page]
+
+    assert [str(u.id) for u in UserResponse.from_json_list(page)] == ids
+
+    uuids = _best(lambda: [uuid.UUID(i) for i in ids])
+    batch_uuids = _best(lambda: parse_uuids(ids))
+    rows = _best(lambda: [UserResponse.from_json(j) for j in page])
+    batch_rows = _best(lambda: UserResponse.from_json_list(page))
+
+    print(f"{ROWS} ids, uuid.UUID:       {uuids * 1000:.2f}ms")
+    print(f"{ROWS} ids, parse_uuids:     {batch_uuids * 1000:.2f}ms")
+    print(f"{ROWS} users, from_json:      {rows * 1000:.2f}ms")
+    print(f"{ROWS} users, from_json_list: {batch_rows * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
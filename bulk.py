@@ -0,0 +1,211 @@
+import concurrent.futures
+import os
+import uuid
+from typing import Iterable, Iterator
+
+from client import Client
+from errors import Conflict, DeadlineExceeded, Error, retry
+from models import UserProfile
+import ucjson
+
+
+class UserRecord:
+    external_alias: str
+    profile: UserProfile
+    profile_ext: dict
+
+    def __init__(self, external_alias, profile=None, profile_ext=None):
+        self.external_alias = external_alias
+        self.profile = profile
+        self.profile_ext = profile_ext
+
+    def to_json(self):
+        return ucjson.dumps(
+            {
+                "external_alias": self.external_alias,
+                "profile": self.profile.__dict__ if self.profile else None,
+                "profile_ext": self.profile_ext,
+            }
+        )
+
+    @staticmethod
+    def from_json(j):
+        return UserRecord(
+            j["external_alias"],
+            UserProfile.from_json(j["profile"]) if j.get("profile") else None,
+            j.get("profile_ext"),
+        )
+
+
+# Stream UserRecords from a file holding one JSON object per line (see UserRecord.to_json)
+def read_user_records(path: str) -> Iterator[UserRecord]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield UserRecord.from_json(ucjson.loads(line))
+
+
+class BulkImportResult:
+    created: int
+    existing: int
+    skipped: int
+    failed: dict[str, Error]
+
+    def __init__(self):
+        self.created = 0
+        self.existing = 0
+        self.skipped = 0
+        self.failed = {}
+
+    def __repr__(self):
+        return (
+            f"BulkImportResult(created={self.created}, existing={self.existing}, "
+            f"skipped={self.skipped}, failed={len(self.failed)})"
+        )
+
+
+# BulkUserImporter creates users from a (possibly very long) stream of UserRecords, keeping
+# `concurrency` creates in flight at once. external_alias is the idempotency key: if a user with
+# that alias already exists we look it up instead of creating a duplicate. Records without an
+# alias can't be imported safely, so run() raises ValueError when it reaches one.
+#
+# Every alias -> ID mapping is appended to mapping_path as soon as it's known, one JSON object
+# per line. The mapping file doubles as the checkpoint: when run() is started again with the same
+# mapping_path, aliases already in it are skipped, so an interrupted import can simply be rerun.
+# Records that fail are reported in the result and not written, so a rerun retries them.
+#
+# A client deadline() or timeout() in effect when run() is called applies to the whole import:
+# once the deadline passes, no more records are started and run() raises DeadlineExceeded after
+# recording the creates that were already in flight.
+class BulkUserImporter:
+    client: Client
+    mapping_path: str
+    concurrency: int
+    max_retries: int
+    fsync_every: int
+
+    def __init__(
+        self,
+        client: Client,
+        mapping_path: str,
+        concurrency: int = 8,
+        max_retries: int = 3,
+        fsync_every: int = 1000,
+    ):
+        self.client = client
+        self.mapping_path = mapping_path
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.fsync_every = fsync_every
+
+    def run(self, records: Iterable[UserRecord]) -> BulkImportResult:
+        result = BulkImportResult()
+        done, torn = self._load_checkpoint()
+        # the workers run under the caller's deadline, if any
+        create = self.client.bind_limits(self._create)
+
+        mapping = open(self.mapping_path, "a", encoding="utf-8")
+        pool = concurrent.futures.ThreadPoolExecutor(self.concurrency)
+        with mapping, pool:
+            if torn:
+                mapping.write("\n")
+            pending = {}
+            written = 0
+
+            # returns the DeadlineExceeded error if the caller's deadline ran out
+            def drain(return_when) -> DeadlineExceeded | None:
+                nonlocal written
+                expired = None
+                finished, _ = concurrent.futures.wait(pending, return_when=return_when)
+                for future in finished:
+                    record = pending.pop(future)
+                    try:
+                        id, created = future.result()
+                    except DeadlineExceeded as e:
+                        # not a failure of this record; it's retried on the next run
+                        expired = e
+                        continue
+                    except Error as e:
+                        result.failed[record.external_alias] = e
+                        continue
+
+                    if created:
+                        result.created += 1
+                    else:
+                        result.existing += 1
+                    done.add(record.external_alias)
+                    mapping.write(
+                        ucjson.dumps({"external_alias": record.external_alias, "id": id})
+                        + "\n"
+                    )
+                    written += 1
+                    if written % self.fsync_every == 0:
+                        mapping.flush()
+                        os.fsync(mapping.fileno())
+                mapping.flush()
+                return expired
+
+            expired = None
+            for record in records:
+                if not record.external_alias:
+                    # without an alias a retried or resumed create could make a duplicate user,
+                    # so stop, after recording what's already in flight
+                    drain(concurrent.futures.ALL_COMPLETED)
+                    raise ValueError("every UserRecord needs an external_alias")
+                if record.external_alias in done:
+                    result.skipped += 1
+                    continue
+
+                # keep a bounded number of records in memory regardless of the input size
+                if len(pending) >= self.concurrency * 2:
+                    expired = drain(concurrent.futures.FIRST_COMPLETED)
+                    if expired is not None:
+                        break
+                pending[pool.submit(create, record)] = record
+
+            if expired is not None:
+                # the budget is spent, so don't start what's still queued; creates already in
+                # flight are still recorded below
+                for future in list(pending):
+                    if future.cancel():
+                        del pending[future]
+            expired = drain(concurrent.futures.ALL_COMPLETED) or expired
+            os.fsync(mapping.fileno())
+            if expired is not None:
+                raise expired
+
+        return result
+
+    # Returns the aliases already imported, and whether the file ends in a partially written line
+    def _load_checkpoint(self) -> tuple[set[str], bool]:
+        done = set()
+        line = ""
+        try:
+            with open(self.mapping_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        done.add(ucjson.loads(line)["external_alias"])
+                    except (ValueError, KeyError):
+                        # a torn last line from a crash; that record will just be retried
+                        pass
+        except FileNotFoundError:
+            pass
+        return done, line != "" and not line.endswith("\n")
+
+    # Returns (id, created)
+    def _create(self, record: UserRecord) -> tuple[uuid.UUID, bool]:
+        return retry(
+            lambda: self._create_once(record), self.max_retries, self.client.time_left
+        )
+
+    def _create_once(self, record: UserRecord) -> tuple[uuid.UUID, bool]:
+        try:
+            id = self.client.CreateUser(
+                record.external_alias, record.profile, record.profile_ext
+            )
+            return id, True
+        except Conflict as e:
+            if e.id is not None:
+                return e.id, False
+            user = self.client.GetUserByExternalAlias_AdminOnly(record.external_alias)
+            return user.id, False
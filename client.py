@@ -1,10 +1,11 @@
 import base64
+import concurrent.futures
+import contextlib
+import threading
 import time
 import uuid
 import urllib.parse
-
-import jwt
-import requests
+from typing import Iterator
 
 from models import (
     AccessPolicy,
@@ -16,21 +17,26 @@ from models import (
     TransformationPolicy,
 )
 from constants import AUTHN_TYPE_PASSWORD
+from hedge import HedgePolicy
+from metrics import Metrics, route
+from transport import RequestsTransport, Transport
+from errors import (
+    Conflict,
+    DeadlineExceeded,
+    Error,
+    NotFound,
+    RateLimited,
+    RequestTimeout,
+    Transient,
+    error_from_response,
+)
+from tokencache import FileTokenCache, token_expiry
 import ucjson
 
 
-class Error(BaseException):
-    def __init__(self, error="unspecified error", code=500, request_id=None):
-        self.error = error
-        self.code = code
-        self.request_id = request_id
-
-    def __repr__(self):
-        return f"Error({self.error}, {self.code}, {self.request_id})"
-
-    @staticmethod
-    def from_json(j):
-        return Error(j["error"], j["request_id"])
+# (connect, read) timeout in seconds applied to every request unless the client is constructed
+# with a different one
+DEFAULT_TIMEOUT = (10, 60)
 
 
 class Client:
@@ -39,20 +45,186 @@ class Client:
     _client_secret: str
 
     _access_token: str
-
-    def __init__(self, url, id, secret):
+    _token_cache: FileTokenCache
+    _token_lock: threading.Lock
+    _timeout: tuple[float, float]
+    _local: threading.local
+    _hedge: HedgePolicy
+    _transport: Transport
+    _metrics: Metrics
+
+    # Constructing a Client doesn't touch the network: the access token is fetched by the first
+    # request, or up front by calling warmup() (or prefetch() to do it in the background).
+    #
+    # token_cache is optional; pass a FileTokenCache to share access tokens between processes
+    # that use the same client ID instead of fetching a new one in every process.
+    #
+    # timeout is either a single number of seconds or a (connect, read) tuple, and applies to
+    # every request made by this client (None disables it). Use deadline() to bound a group of
+    # calls as a whole.
+    #
+    # hedge is optional; pass a HedgePolicy to hedge slow idempotent reads (GetUser_AdminOnly and
+    # ExecuteAccessor) with a duplicate request.
+    #
+    # transport defaults to a pooled requests session; see transport.py for recording and
+    # replaying traffic instead.
+    #
+    # metrics is optional; pass a Metrics to collect request counts, latencies, bytes, token
+    # refreshes, JSON decode time and connection pool state, and read them from it. Pool state is
+    # only reported for the client's own default transport; a transport passed in may be shared,
+    # so its owner registers its pool_stats (as ClientRegistry does).
+    def __init__(
+        self,
+        url,
+        id,
+        secret,
+        token_cache: FileTokenCache = None,
+        prefetch: bool = False,
+        timeout: float | tuple[float, float] | None = DEFAULT_TIMEOUT,
+        hedge: HedgePolicy = None,
+        transport: Transport = None,
+        metrics: Metrics = None,
+    ):
         self.url = url
         self.client_id = urllib.parse.quote(id)
         self._client_secret = urllib.parse.quote(secret)
+        self._token_cache = token_cache
+        self._token_lock = threading.Lock()
+        if not isinstance(timeout, tuple):
+            timeout = (timeout, timeout)
+        self._timeout = timeout
+        self._local = threading.local()
+        self._hedge = hedge
+        self._transport = transport or RequestsTransport()
+        self._metrics = metrics
+        if metrics is not None:
+            if transport is None:
+                metrics.register_gauge(
+                    "userclouds_pool_connections", self._transport.pool_stats
+                )
+            if hedge is not None:
+                metrics.register_gauge("userclouds_hedge_queued", hedge.queued)
+        self._headers = None
+        self._expiry = None
+
+        self._access_token = None
+        if prefetch:
+            self.prefetch()
+
+    # Fetch an access token now (if we don't already have a valid one), so that the first real
+    # request doesn't pay for it.
+    def warmup(self):
+        self._refresh_access_token_if_needed()
 
-        self._access_token = self._get_access_token()
+    # Same as warmup(), but on a background thread. The returned future resolves once the token
+    # has been fetched, and holds the exception if fetching it failed.
+    def prefetch(self) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+
+        def run():
+            try:
+                self.warmup()
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(None)
+
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+    # Release the transport's pooled connections (or close its recording)
+    def close(self):
+        self._transport.close()
+
+    # Counters for hedged requests (see HedgePolicy), or None if hedging isn't enabled
+    def hedge_stats(self) -> dict | None:
+        if self._hedge is None:
+            return None
+        return self._hedge.stats()
+
+    # Bound every call made on this thread inside the block by an overall budget of `seconds`:
+    # each request gets at most the time that's left, and once it's spent further requests raise
+    # DeadlineExceeded instead of being sent. Nested deadlines can only shorten the outer one.
+    #
+    #   with client.deadline(2.0):
+    #       for id in ids:
+    #           client.GetUser_AdminOnly(id)
+    #
+    # The deadline also applies to batch helpers like BulkUserImporter and AccessorExport, which
+    # carry it over to their worker threads (see bind_limits()).
+    @contextlib.contextmanager
+    def deadline(self, seconds: float):
+        with self._limits(time.monotonic() + seconds, None):
+            yield
+
+    # Override the client's timeout for calls made on this thread inside the block, e.g. to give
+    # one slow call more time or to fail fast on a latency-sensitive path. Like the client-wide
+    # timeout it's a number of seconds or a (connect, read) tuple.
+    #
+    #   with client.timeout((1, 2)):
+    #       client.ExecuteAccessor(...)
+    @contextlib.contextmanager
+    def timeout(self, timeout: float | tuple[float, float] | None):
+        if not isinstance(timeout, tuple):
+            timeout = (timeout, timeout)
+        with self._limits(None, timeout):
+            yield
+
+    # Seconds left before this thread's deadline() runs out, or None if there's no deadline
+    def time_left(self) -> float | None:
+        deadline = getattr(self._local, "deadline", None)
+        if deadline is None:
+            return None
+        return max(0.0, deadline - time.monotonic())
+
+    # Wrap fn so that it runs under the deadline and timeout override (if any) in effect on the
+    # calling thread at the time of wrapping, for handing work to a thread pool.
+    def bind_limits(self, fn):
+        deadline = getattr(self._local, "deadline", None)
+        timeout = getattr(self._local, "timeout", None)
+        if deadline is None and timeout is None:
+            return fn
+
+        def bound(*args, **kwargs):
+            with self._limits(deadline, timeout):
+                return fn(*args, **kwargs)
+
+        return bound
+
+    # Apply a deadline and/or timeout override on this thread for the duration of the block.
+    # Deadlines can only be shortened by nesting; timeout overrides replace the outer one.
+    @contextlib.contextmanager
+    def _limits(self, deadline: float | None, timeout: tuple | None):
+        outer_deadline = getattr(self._local, "deadline", None)
+        outer_timeout = getattr(self._local, "timeout", None)
+        if outer_deadline is not None and (deadline is None or outer_deadline < deadline):
+            deadline = outer_deadline
+        if timeout is None:
+            timeout = outer_timeout
+
+        self._local.deadline = deadline
+        self._local.timeout = timeout
+        try:
+            yield
+        finally:
+            self._local.deadline = outer_deadline
+            self._local.timeout = outer_timeout
 
     # User Operations
 
-    def CreateUser(self, external_alias: str = None) -> uuid.UUID:
+    def CreateUser(
+        self,
+        external_alias: str = None,
+        profile: UserProfile = None,
+        profile_ext: dict = None,
+    ) -> uuid.UUID:
         body = {}
         if external_alias is not None:
             body["external_alias"] = external_alias
+        if profile is not None:
+            body["profile"] = profile.__dict__
+        if profile_ext is not None:
+            body["profile_ext"] = profile_ext
 
         j = self._post("/authn/users", data=ucjson.dumps(body))
         return j.get("id")
@@ -87,14 +259,36 @@ class Client:
         params["version"] = "2"
         j = self._get("/authn/users", params=params)
         if email is None:
-            users = [UserResponse.from_json(ur) for ur in j["data"]]
+            users = UserResponse.from_json_list(j["data"])
         else:
-            users = [UserResponse.from_json(ur) for ur in j]
+            users = UserResponse.from_json_list(j)
         return users
 
+    # This API bypasses any access policies and should only be used by admins
+    #
+    # Iterates over every user in the tenant (or every user after starting_after, in ID order),
+    # fetching page_size users per request. Wrap the iteration in deadline() to put an overall
+    # time budget on the scan.
+    def IterUsers_AdminOnly(
+        self, page_size: int = 100, starting_after: uuid.UUID = None
+    ) -> Iterator[UserResponse]:
+        params = {"limit": page_size, "version": "2"}
+        if starting_after is not None:
+            params["starting_after"] = f"id:{str(starting_after)}"
+        while True:
+            j = self._get("/authn/users", params=params)
+            users = UserResponse.from_json_list(j["data"])
+            yield from users
+
+            # the server may cap the page size below page_size, so a short page doesn't mean
+            # we're done; follow its cursor instead (and stop at an empty page if it has none)
+            if not users or not j.get("has_next", True):
+                return
+            params["starting_after"] = j.get("next") or f"id:{users[-1].id}"
+
     # This API bypasses any access policies and should only be used by admins
     def GetUser_AdminOnly(self, id: uuid.UUID) -> UserResponse:
-        j = self._get(f"/authn/users/{str(id)}")
+        j = self._get(f"/authn/users/{str(id)}", hedge=True)
         return UserResponse.from_json(j)
 
     # This API bypasses any access policies and should only be used by admins
@@ -240,9 +434,24 @@ class Client:
             "selector_values": selector_values,
         }
 
-        j = self._post("/userstore/api/accessors", data=ucjson.dumps(body))
+        # executing an accessor only reads data, so it's safe to hedge even though it's a POST
+        j = self._post("/userstore/api/accessors", hedge=True, data=ucjson.dumps(body))
         return j.get("value")
 
+    # Returns a callable handle for executing the same accessor with the same context many times.
+    # The accessor ID and context are serialized once up front, so each call only has to encode
+    # its selector values:
+    #
+    #   get_details = client.prepare_accessor(accessor_id, {"purpose": "support"})
+    #   for uid in uids:
+    #       details = get_details([uid])
+    #
+    # Handles are immutable and can be shared across threads.
+    def prepare_accessor(
+        self, accessor_id: uuid.UUID, context: dict
+    ) -> "PreparedAccessor":
+        return PreparedAccessor(self, accessor_id, context)
+
     # Mutator Operations
     def CreateMutator(self, mutator: Mutator) -> Mutator:
         body = {"mutator": mutator.__dict__}
@@ -294,6 +503,13 @@ class Client:
 
     # Access token helpers
 
+    def _fetch_access_token(self) -> str:
+        if self._token_cache is None:
+            return self._get_access_token()
+        return self._token_cache.get_or_refresh(
+            f"{self.url}|{self.client_id}", self._get_access_token
+        )
+
     def _get_access_token(self) -> str:
         # Encode the client ID and client secret
         authorization = base64.b64encode(
@@ -306,76 +522,195 @@ class Client:
         }
         body = {"grant_type": "client_credentials"}
 
-        # Note that we use requests directly here (instead of _post) because we don't
+        # Note that we use the transport directly here (instead of _post) because we don't
         # want to refresh the access token as we are trying to get it. :)
-        r = requests.post(self.url + "/oidc/token", headers=headers, data=body)
-        j = ucjson.loads(r.text)
-        return j.get("access_token")
-
-    def _refresh_access_token_if_needed(self):
-        if self._access_token is None:
-            return
+        r = self._transport.request(
+            "POST",
+            self.url + "/oidc/token",
+            headers=headers,
+            data=body,
+            timeout=self._request_timeout(),
+        )
+        if r.status_code >= 400:
+            raise error_from_response(r)
+        return ucjson.loads(r.text).get("access_token")
 
+    def _access_token_valid(self) -> bool:
         # TODO: this takes advantage of an implementation detail that we use JWTs for access tokens,
         # but we should probably either expose an endpoint to verify expiration time, or expect to
         # retry requests with a well-formed error, or change our bearer token format in time.
-        if (
-            jwt.decode(self._access_token, options={"verify_signature": False}).get(
-                "exp"
-            )
-            < time.time()
-        ):
-            self._access_token = self._get_access_token()
+        token = self._access_token
+        if token is None:
+            return False
+
+        # decoding the token on every request adds up, so remember the expiry of the current one
+        expiry = self._expiry
+        if expiry is None or expiry[0] is not token:
+            expiry = (token, token_expiry(token))
+            self._expiry = expiry
+        return expiry[1] >= time.time()
+
+    def _refresh_access_token_if_needed(self):
+        if self._access_token_valid():
+            return
+
+        # only one thread fetches the token, the rest wait for it and reuse it
+        with self._token_lock:
+            if not self._access_token_valid():
+                start = time.perf_counter()
+                self._access_token = self._fetch_access_token()
+                if self._metrics is not None:
+                    self._metrics.inc("userclouds_token_refreshes_total")
+                    self._metrics.observe(
+                        "userclouds_token_refresh_seconds", time.perf_counter() - start
+                    )
 
     def _get_headers(self) -> dict:
-        return {"Authorization": f"Bearer {self._access_token}"}
+        # rebuilt only when the token changes rather than on every request; the dict is kept
+        # together with the token it was built for so that threads never see a mismatched pair
+        token = self._access_token
+        headers = self._headers
+        if headers is None or headers[1] is not token:
+            headers = ({"Authorization": f"Bearer {token}"}, token)
+            self._headers = headers
+        return headers[0]
 
     # Request helpers
 
-    def _get(self, url, **kwargs) -> dict:
+    def _request_timeout(self) -> tuple[float, float]:
+        timeout = getattr(self._local, "timeout", None) or self._timeout
+        deadline = getattr(self._local, "deadline", None)
+        if deadline is None:
+            return timeout
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded()
+        return tuple(remaining if t is None else min(t, remaining) for t in timeout)
+
+    # Idempotent reads pass hedge=True; they're hedged if the client has a HedgePolicy.
+    def _request(self, method, url, hedge=False, **kwargs):
         self._refresh_access_token_if_needed()
-        r = requests.get(self.url + url, headers=self._get_headers(), **kwargs)
-        j = ucjson.loads(r.text)
 
-        if r.status_code >= 400:
-            e = Error.from_json(j)
-            e.code = r.status_code
-            raise e
+        # send JSON bodies as UTF-8 (ucjson keeps non-ASCII characters as-is, which http.client
+        # would otherwise encode as Latin-1), and so that metrics count bytes, not characters
+        data = kwargs.get("data")
+        if isinstance(data, str):
+            kwargs["data"] = data.encode("utf-8")
 
-        return j
+        # the headers and timeout are computed here, on the calling thread, because the deadline
+        # is thread-local and hedged attempts run on the policy's worker threads
+        headers = self._get_headers()
+        timeout = self._request_timeout()
 
-    def _post(self, url, **kwargs) -> dict:
-        self._refresh_access_token_if_needed()
-        r = requests.post(self.url + url, headers=self._get_headers(), **kwargs)
+        def send():
+            return self._transport.request(
+                method, self.url + url, headers=headers, timeout=timeout, **kwargs
+            )
+
+        if self._metrics is not None:
+            send = self._measured(send, method, url, kwargs.get("data"))
+
+        try:
+            if hedge and self._hedge is not None:
+                return self._hedge.run(send)
+            return send()
+        except RequestTimeout as e:
+            deadline = getattr(self._local, "deadline", None)
+            if deadline is not None and deadline <= time.monotonic():
+                raise DeadlineExceeded() from e
+            raise
+
+    def _measured(self, send, method, url, data):
+        m = self._metrics
+        labels = {"method": method, "route": route(url)}
+
+        def measured_send():
+            m.add("userclouds_requests_in_flight", 1)
+            start = time.perf_counter()
+            try:
+                r = send()
+            except Error as e:
+                m.inc(
+                    "userclouds_request_errors_total", type=type(e).__name__, **labels
+                )
+                raise
+            finally:
+                m.add("userclouds_requests_in_flight", -1)
+
+            m.observe(
+                "userclouds_request_duration_seconds",
+                time.perf_counter() - start,
+                **labels,
+            )
+            m.inc("userclouds_requests_total", status=r.status_code, **labels)
+            if data:
+                m.inc("userclouds_bytes_out_total", len(data))
+            content = getattr(r, "content", None)
+            m.inc("userclouds_bytes_in_total", len(content or r.text or ""))
+            return r
+
+        return measured_send
+
+    def _decode(self, r) -> dict:
+        if self._metrics is None:
+            return ucjson.loads(r.text)
+
+        start = time.perf_counter()
         j = ucjson.loads(r.text)
+        self._metrics.observe(
+            "userclouds_json_decode_seconds", time.perf_counter() - start
+        )
+        return j
 
+    def _get(self, url, hedge=False, **kwargs) -> dict:
+        r = self._request("GET", url, hedge=hedge, **kwargs)
         if r.status_code >= 400:
-            e = Error.from_json(j)
-            e.code = r.status_code
-            raise e
+            raise error_from_response(r)
 
-        return j
+        return self._decode(r)
 
-    def _put(self, url, **kwargs) -> dict:
-        self._refresh_access_token_if_needed()
-        r = requests.put(self.url + url, headers=self._get_headers(), **kwargs)
-        j = ucjson.loads(r.text)
+    def _post(self, url, hedge=False, **kwargs) -> dict:
+        r = self._request("POST", url, hedge=hedge, **kwargs)
+        if r.status_code >= 400:
+            raise error_from_response(r)
 
+        return self._decode(r)
+
+    def _put(self, url, **kwargs) -> dict:
+        r = self._request("PUT", url, **kwargs)
         if r.status_code >= 400:
-            e = Error.from_json(j)
-            e.code = r.status_code
-            raise e
+            raise error_from_response(r)
 
-        return j
+        return self._decode(r)
 
     def _delete(self, url, **kwargs) -> bool:
-        self._refresh_access_token_if_needed()
-        r = requests.delete(self.url + url, headers=self._get_headers(), **kwargs)
+        r = self._request("DELETE", url, **kwargs)
 
         if r.status_code >= 400:
-            j = ucjson.loads(r.text)
-            e = Error.from_json(j)
-            e.code = r.status_code
-            raise e
+            raise error_from_response(r)
 
         return r.status_code == 204
+
+
+class PreparedAccessor:
+    client: Client
+    accessor_id: uuid.UUID
+
+    def __init__(self, client: Client, accessor_id: uuid.UUID, context: dict):
+        self.client = client
+        self.accessor_id = accessor_id
+        # everything but the selector values, pre-encoded; the body's closing brace is added
+        # per call
+        self._prefix = (
+            '{"accessor_id": %s, "context": %s, "selector_values": '
+            % (ucjson.dumps(accessor_id), ucjson.dumps(context))
+        ).encode("utf-8")
+
+    def __repr__(self):
+        return f"PreparedAccessor({self.accessor_id})"
+
+    def __call__(self, selector_values: list) -> str:
+        data = self._prefix + ucjson.dumps(selector_values).encode("utf-8") + b"}"
+        j = self.client._post("/userstore/api/accessors", hedge=True, data=data)
+        return j.get("value")
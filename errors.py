@@ -0,0 +1,129 @@
+import time
+import uuid
+
+import ucjson
+
+
+class Error(Exception):
+    def __init__(self, error="unspecified error", code=500, request_id=None):
+        super().__init__(error)
+        self.error = error
+        self.code = code
+        self.request_id = request_id
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.error}, {self.code}, {self.request_id})"
+
+    def __str__(self):
+        return f"{self.code}: {self.error}"
+
+    @staticmethod
+    def from_json(j):
+        return Error(j.get("error"), request_id=j.get("request_id"))
+
+
+class NotFound(Error):
+    pass
+
+
+# Conflict is raised when creating something that already exists; id holds the ID of the
+# existing object when the server sends it back.
+class Conflict(Error):
+    id: uuid.UUID
+
+    def __init__(self, error="conflict", code=409, request_id=None):
+        super().__init__(error, code, request_id)
+        self.id = None
+        if isinstance(error, dict) and error.get("id") is not None:
+            # a malformed ID shouldn't turn the conflict into a decode error
+            try:
+                self.id = uuid.UUID(str(error["id"]))
+            except ValueError:
+                pass
+
+
+# RateLimited carries the number of seconds the server asked us to wait (from Retry-After), or
+# None if it didn't say.
+class RateLimited(Error):
+    retry_after: float
+
+    def __init__(
+        self, error="rate limited", code=429, request_id=None, retry_after=None
+    ):
+        super().__init__(error, code, request_id)
+        self.retry_after = retry_after
+
+
+# Transient errors are likely to succeed if retried: gateway/availability errors from the server
+# or proxies in front of it, and requests that never got a response at all.
+class Transient(Error):
+    pass
+
+
+# The server didn't respond in time (see Client's timeout)
+class RequestTimeout(Transient):
+    def __init__(self, error="request timed out", code=504, request_id=None):
+        super().__init__(error, code, request_id)
+
+
+class DeadlineExceeded(Error):
+    def __init__(self, error="deadline exceeded", code=504, request_id=None):
+        super().__init__(error, code, request_id)
+
+
+# Call fn() until it succeeds, retrying it up to max_retries times when it fails with an error
+# that's likely to go away. Each retry waits for as long as the server asked (Retry-After), or
+# backs off exponentially (2s, 4s, ... up to 30s) if it didn't say.
+#
+# time_left, if given, returns the seconds left on the caller's deadline (or None if there's no
+# deadline, see Client.time_left); a retry that would have to wait past it raises
+# DeadlineExceeded instead.
+def retry(fn, max_retries: int, time_left=None):
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except (RateLimited, Transient) as e:
+            attempt += 1
+            if attempt > max_retries:
+                raise
+            delay = getattr(e, "retry_after", None) or min(2**attempt, 30)
+            left = time_left() if time_left is not None else None
+            if left is not None and delay >= left:
+                raise DeadlineExceeded() from e
+            time.sleep(delay)
+
+
+_TRANSIENT_CODES = {408, 502, 503, 504}
+
+
+# Build the right Error subclass for a failed response. The body is only parsed here, on the
+# error path, and a body that isn't JSON (e.g. an HTML 502 page from a proxy) is kept as text.
+def error_from_response(r) -> Error:
+    try:
+        j = ucjson.loads(r.text)
+    except ValueError:
+        j = None
+    if isinstance(j, dict):
+        error, request_id = j.get("error", r.text), j.get("request_id")
+    else:
+        error, request_id = r.text or "unspecified error", None
+
+    code = r.status_code
+    if code == 404:
+        return NotFound(error, code, request_id)
+    if code == 409:
+        return Conflict(error, code, request_id)
+    if code == 429:
+        return RateLimited(error, code, request_id, _retry_after(r.headers))
+    if code in _TRANSIENT_CODES:
+        return Transient(error, code, request_id)
+    return Error(error, code, request_id)
+
+
+def _retry_after(headers) -> float | None:
+    # Retry-After may also be an HTTP date, but we only send (and only honor) delta-seconds
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,269 @@
+import abc
+import collections
+import concurrent.futures
+import csv
+import io
+import os
+import uuid
+from typing import Callable, Iterable, Iterator
+
+from client import Client
+from errors import DeadlineExceeded, Error, retry
+import ucjson
+
+
+# Read user IDs from a file with one ID per line
+def read_user_ids(path: str) -> Iterator[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+# Every user ID in the tenant, in ID order, fetched a page at a time. Users can be created or
+# deleted between an export crashing and being resumed, so AccessorExport resumes this source
+# after the last user it wrote (with after()) rather than by counting users.
+class TenantUserIDs:
+    client: Client
+    page_size: int
+
+    def __init__(self, client: Client, page_size: int = 500):
+        self.client = client
+        self.page_size = page_size
+
+    def __iter__(self) -> Iterator[uuid.UUID]:
+        return self.after(None)
+
+    def after(self, id: uuid.UUID | None) -> Iterator[uuid.UUID]:
+        for user in self.client.IterUsers_AdminOnly(self.page_size, starting_after=id):
+            yield user.id
+
+
+def all_user_ids(client: Client, page_size: int = 500) -> TenantUserIDs:
+    return TenantUserIDs(client, page_size)
+
+
+# Sinks write export rows to a file through a large buffer. checkpoint() makes everything written
+# so far durable and returns the file offset it reached; opening a sink at that offset again
+# truncates anything written after the checkpoint, so a resumed export never duplicates rows.
+class FileSink(abc.ABC):
+    path: str
+    buffer_size: int
+
+    def __init__(self, path: str, buffer_size: int = 1 << 20):
+        self.path = path
+        self.buffer_size = buffer_size
+        self._raw = None
+        self._text = None
+
+    def open(self, offset: int = 0):
+        mode = "r+b" if offset > 0 else "wb"
+        self._raw = open(self.path, mode, buffering=self.buffer_size)
+        self._raw.seek(offset)
+        self._raw.truncate()
+        self._text = io.TextIOWrapper(self._raw, encoding="utf-8", newline="")
+
+    @abc.abstractmethod
+    def write(self, user_id, value):
+        pass
+
+    def checkpoint(self) -> int:
+        self._text.flush()
+        os.fsync(self._raw.fileno())
+        return self._raw.tell()
+
+    def close(self):
+        if self._text is not None:
+            self._text.close()
+            self._text = None
+
+
+# One {"id": ..., "value": ...} JSON object per line
+class NDJSONSink(FileSink):
+    def write(self, user_id, value):
+        self._text.write(ucjson.dumps({"id": user_id, "value": value}) + "\n")
+
+
+# One CSV row per user: the user ID followed by the accessor's values (a list of values is
+# spread across columns). columns, if given, is written as a header row.
+class CSVSink(FileSink):
+    columns: list[str]
+
+    def __init__(
+        self, path: str, columns: list[str] = None, buffer_size: int = 1 << 20
+    ):
+        super().__init__(path, buffer_size)
+        self.columns = columns
+
+    def open(self, offset: int = 0):
+        super().open(offset)
+        self._writer = csv.writer(self._text)
+        if offset == 0 and self.columns:
+            self._writer.writerow(["id"] + self.columns)
+
+    def write(self, user_id, value):
+        values = value if isinstance(value, list) else [value]
+        self._writer.writerow([str(user_id)] + values)
+
+
+# One {"id": ..., "error": ..., "code": ..., "request_id": ...} JSON object per line, for the
+# users an export couldn't fetch
+class ErrorSink(FileSink):
+    def write(self, user_id, error: Error):
+        self._text.write(
+            ucjson.dumps(
+                {
+                    "id": user_id,
+                    "error": error.error,
+                    "code": error.code,
+                    "request_id": error.request_id,
+                }
+            )
+            + "\n"
+        )
+
+
+# AccessorExport runs an accessor for every user from a stream of user IDs (e.g. read_user_ids()
+# or all_user_ids()) and writes the results to a sink as they come in, for exports (like DSAR
+# requests) that are too big to hold in memory. Up to `concurrency` accessor calls are in flight
+# at once, and at most twice that many results are buffered, whatever the size of the export.
+#
+# Rows are written in input order, and every checkpoint_every rows the sink is fsynced and the
+# position reached (and the last user ID written) is saved to checkpoint_path. If the export
+# crashes, running it again with the same inputs, sink and checkpoint path resumes from the last
+# checkpoint: all_user_ids() resumes after the last user written, and any other input (such as
+# read_user_ids()) by skipping the users already processed, which must not have changed.
+#
+# A user the accessor fails for (not found, denied by a policy, or still failing after
+# max_retries retries of a transient error) doesn't stop the export: the error is written to
+# errors_path (the sink's path plus ".errors" by default) instead, and counted in `failed`.
+#
+# A client deadline() or timeout() in effect when run() is called applies to the whole export.
+#
+#   export = AccessorExport(client, accessor_id, {"purpose": "dsar"}, NDJSONSink("out.ndjson"),
+#                           "out.checkpoint")
+#   export.run(read_user_ids("users.txt"))
+class AccessorExport:
+    client: Client
+    sink: FileSink
+    checkpoint_path: str
+    concurrency: int
+    checkpoint_every: int
+    max_retries: int
+    failed: int
+
+    def __init__(
+        self,
+        client: Client,
+        accessor_id: uuid.UUID,
+        context: dict,
+        sink: FileSink,
+        checkpoint_path: str,
+        concurrency: int = 8,
+        checkpoint_every: int = 1000,
+        selector: Callable[[object], list] = lambda id: [id],
+        errors_path: str = None,
+        max_retries: int = 3,
+    ):
+        self.client = client
+        self.sink = sink
+        self.checkpoint_path = checkpoint_path
+        self.concurrency = concurrency
+        self.checkpoint_every = checkpoint_every
+        self.max_retries = max_retries
+        self.failed = 0
+        self._errors = ErrorSink(errors_path or sink.path + ".errors")
+        self._accessor = client.prepare_accessor(accessor_id, context)
+        self._selector = selector
+
+    # Returns the total number of users processed (exported or failed), including any from before
+    # a resume
+    def run(self, user_ids: Iterable) -> int:
+        state = self._load_checkpoint()
+        position = state.get("position", 0)
+        last_id = state.get("last_id")
+        self.failed = 0
+        self._last_id = last_id
+
+        skip = position
+        if last_id is not None and isinstance(user_ids, TenantUserIDs):
+            user_ids = user_ids.after(uuid.UUID(last_id))
+            skip = 0
+
+        self.sink.open(state.get("offset", 0))
+        self._errors.open(state.get("errors_offset", 0))
+        # the workers run under the caller's deadline, if any
+        fetch = self.client.bind_limits(self._fetch)
+
+        pending = collections.deque()
+        pool = concurrent.futures.ThreadPoolExecutor(self.concurrency)
+        try:
+            for i, user_id in enumerate(user_ids):
+                if i < skip:
+                    if i == skip - 1 and last_id is not None and str(user_id) != last_id:
+                        raise ValueError(
+                            f"input changed since the checkpoint: expected {last_id} at "
+                            f"position {i}, found {user_id}"
+                        )
+                    continue
+
+                # results are written in order, so wait for the oldest once the window is full
+                if len(pending) >= self.concurrency * 2:
+                    position = self._write(pending.popleft(), position)
+                pending.append(
+                    (user_id, pool.submit(fetch, self._selector(user_id)))
+                )
+
+            while pending:
+                position = self._write(pending.popleft(), position)
+            self._save_checkpoint(position)
+        finally:
+            for _, future in pending:
+                future.cancel()
+            pool.shutdown()
+            self.sink.close()
+            self._errors.close()
+
+        return position
+
+    def _fetch(self, selector_values: list):
+        return retry(
+            lambda: self._accessor(selector_values),
+            self.max_retries,
+            self.client.time_left,
+        )
+
+    def _write(self, item, position: int) -> int:
+        user_id, future = item
+        try:
+            value = future.result()
+        except DeadlineExceeded:
+            # the caller's budget for the whole export ran out
+            raise
+        except Error as e:
+            self._errors.write(user_id, e)
+            self.failed += 1
+        else:
+            self.sink.write(user_id, value)
+        self._last_id = str(user_id)
+        position += 1
+        if position % self.checkpoint_every == 0:
+            self._save_checkpoint(position)
+        return position
+
+    def _load_checkpoint(self) -> dict:
+        try:
+            with open(self.checkpoint_path, "r") as f:
+                return ucjson.loads(f.read())
+        except FileNotFoundError:
+            return {}
+
+    def _save_checkpoint(self, position: int):
+        state = {
+            "position": position,
+            "offset": self.sink.checkpoint(),
+            "errors_offset": self._errors.checkpoint(),
+            "last_id": self._last_id,
+        }
+        ucjson.dump_file(self.checkpoint_path, state)
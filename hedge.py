@@ -0,0 +1,149 @@
+import collections
+import concurrent.futures
+import sys
+import threading
+import time
+
+
+# HedgePolicy sends a duplicate ("hedge") of a slow idempotent read once the original has been
+# outstanding for longer than the given percentile of recently observed latencies, and returns
+# whichever response arrives first. The loser can't be interrupted mid-flight with a blocking HTTP
+# client, so its response is simply discarded (and its connection released) when it completes.
+#
+# budget caps the fraction of requests that may be hedged, so a slow server doesn't get twice
+# the load exactly when it can least afford it. Until enough latencies have been observed,
+# initial_delay is used.
+#
+# Attempts run on the policy's worker threads, which are reused but (unless max_workers is given)
+# not capped, so hedging doesn't limit how many requests the caller can have in flight. The hedge
+# delay is timed from when a worker actually starts sending, so time spent waiting for a worker
+# never triggers a hedge.
+#
+#   client = Client(url, id, secret, hedge=HedgePolicy(percentile=95, budget=0.05))
+#   ...
+#   client.hedge_stats()  # {"requests": ..., "hedged": ..., "hedge_wins": ..., ...}
+class HedgePolicy:
+    percentile: float
+    budget: float
+    initial_delay: float
+    min_delay: float
+    min_samples: int
+
+    def __init__(
+        self,
+        percentile: float = 95,
+        budget: float = 0.05,
+        initial_delay: float = 0.5,
+        min_delay: float = 0.005,
+        window: int = 1000,
+        min_samples: int = 50,
+        max_workers: int = None,
+    ):
+        self.percentile = percentile
+        self.budget = budget
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=window)
+        self._delay = initial_delay
+        self._since_recompute = 0
+        # ThreadPoolExecutor only starts a new thread when none are idle
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers or sys.maxsize, thread_name_prefix="userclouds-hedge"
+        )
+
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.budget_exhausted = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "budget_exhausted": self.budget_exhausted,
+                "delay": self._delay,
+            }
+
+    # Number of attempts (originals or hedges) waiting for a worker thread
+    def queued(self) -> int:
+        return self._pool._work_queue.qsize()
+
+    # Run send() (which performs one HTTP request and returns its response), hedging it if the
+    # first attempt is slow.
+    def run(self, send):
+        with self._lock:
+            self.requests += 1
+            delay = self._delay
+
+        started = threading.Event()
+
+        def timed_send():
+            started.set()
+            start = time.perf_counter()
+            try:
+                return send()
+            finally:
+                # latencies come from the original attempt only, so hedging doesn't skew the
+                # distribution
+                self._record(time.perf_counter() - start)
+
+        primary = self._pool.submit(timed_send)
+        started.wait()
+        try:
+            return primary.result(timeout=delay)
+        except concurrent.futures.TimeoutError:
+            pass
+
+        if not self._take_budget():
+            return primary.result()
+
+        backup = self._pool.submit(send)
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for f in done:
+                if f.exception() is not None:
+                    error = error or f.exception()
+                    continue
+
+                if f is backup:
+                    with self._lock:
+                        self.hedge_wins += 1
+                for loser in pending:
+                    loser.add_done_callback(_discard)
+                return f.result()
+
+        raise error
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self.hedged + 1 > self.budget * self.requests:
+                self.budget_exhausted += 1
+                return False
+            self.hedged += 1
+            return True
+
+    def _record(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+            self._since_recompute += 1
+            # re-sorting the window on every request would cost more than it's worth
+            if len(self._latencies) < self.min_samples or self._since_recompute < 20:
+                return
+            self._since_recompute = 0
+            ordered = sorted(self._latencies)
+            i = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+            self._delay = max(self.min_delay, ordered[i])
+
+
+def _discard(f: concurrent.futures.Future):
+    if not f.cancelled() and f.exception() is None:
+        f.result().close()
@@ -0,0 +1,172 @@
+import bisect
+import re
+import threading
+from typing import Callable
+
+# latency buckets in seconds, roughly log-spaced from 1ms to 30s
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+)
+
+_ID_SEGMENT = re.compile(r"/[0-9a-fA-F]{8}(-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}")
+
+
+# Collapse the IDs in a request path so that metrics are labeled per endpoint rather than per
+# object, e.g. /authn/users/<uuid> -> /authn/users/:id
+def route(path: str) -> str:
+    return _ID_SEGMENT.sub("/:id", path)
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+# Metrics is a small, thread-safe registry of counters, gauges and histograms that a Client
+# updates as it works (pass Client(..., metrics=Metrics())). It's pull-based: read it with
+# snapshot() for a plain dict, or to_prometheus() for the Prometheus text exposition format to
+# serve from your own /metrics endpoint. Gauges can also be registered as callbacks that are
+# evaluated at read time, which is how connection pool state is reported.
+class Metrics:
+    buckets: tuple[float, ...]
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._callbacks = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    # Adjust a gauge by delta, e.g. +1/-1 around an in-flight request
+    def add(self, name: str, delta: float, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + delta
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[(name, _labels(labels))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = _Histogram(self.buckets)
+            h.observe(value)
+
+    # fn returns either a number, or a dict mapping label tuples such as (("state", "idle"),) to
+    # numbers
+    def register_gauge(self, name: str, fn: Callable[[], float | dict]):
+        with self._lock:
+            self._callbacks[name] = fn
+
+    def snapshot(self) -> dict:
+        gauges = self._collect_callbacks()
+        with self._lock:
+            gauges.update(self._gauges)
+            return {
+                "counters": {_name(k): v for k, v in self._counters.items()},
+                "gauges": {_name(k): v for k, v in gauges.items()},
+                "histograms": {
+                    _name(k): {
+                        "count": h.count,
+                        "sum": h.sum,
+                        "buckets": dict(zip(self.buckets + ("+Inf",), _cumulative(h))),
+                    }
+                    for k, h in self._histograms.items()
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        gauges = self._collect_callbacks()
+        lines = []
+        with self._lock:
+            gauges.update(self._gauges)
+            for kind, series in (("counter", self._counters), ("gauge", gauges)):
+                for name in sorted({k[0] for k in series}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for key, v in series.items():
+                        if key[0] == name:
+                            lines.append(f"{_name(key)} {v}")
+
+            for name in sorted({k[0] for k in self._histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                bounds = [str(b) for b in self.buckets] + ["+Inf"]
+                for (n, labels), h in self._histograms.items():
+                    if n != name:
+                        continue
+                    for le, c in zip(bounds, _cumulative(h)):
+                        bucket = _name((name + "_bucket", labels + (("le", le),)))
+                        lines.append(f"{bucket} {c}")
+                    lines.append(f"{_name((name + '_sum', labels))} {h.sum}")
+                    lines.append(f"{_name((name + '_count', labels))} {h.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def _collect_callbacks(self) -> dict:
+        with self._lock:
+            callbacks = list(self._callbacks.items())
+
+        # called outside the lock, since callbacks may be slow or take their own locks
+        gauges = {}
+        for name, fn in callbacks:
+            value = fn()
+            if isinstance(value, dict):
+                for labels, v in value.items():
+                    gauges[(name, tuple(sorted((k, str(l)) for k, l in labels)))] = v
+            else:
+                gauges[(name, ())] = value
+        return gauges
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _name(key: tuple) -> str:
+    name, labels = key
+    if not labels:
+        return name
+    pairs = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return f"{name}{{{pairs}}}"
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _cumulative(h: _Histogram) -> list[int]:
+    total = 0
+    out = []
+    for c in h.counts:
+        total += c
+        out.append(total)
+    return out
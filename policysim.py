@@ -0,0 +1,143 @@
+import functools
+import statistics
+import time
+
+from models import AccessPolicy, TransformationPolicy
+import ucjson
+
+# The policy functions are evaluated with QuickJS, which is an optional dependency that is only
+# needed for simulation (pip install quickjs). It's imported on first use.
+
+# Policy functions are all declared as `function policy(...)`; we wrap them so that arguments and
+# results cross the Python/JS boundary as JSON, which keeps nested objects intact.
+_WRAPPER = """
+%s
+function __uc_simulate(arg, params) {
+    return JSON.stringify(policy(JSON.parse(arg), JSON.parse(params)));
+}
+"""
+
+
+@functools.lru_cache(maxsize=256)
+def _compile(function: str, time_limit: float):
+    try:
+        import quickjs
+    except ImportError as e:
+        raise ImportError(
+            "policy simulation requires the quickjs package (pip install quickjs)"
+        ) from e
+
+    # quickjs.Function runs in its own thread, so a compiled policy can be shared across threads
+    f = quickjs.Function("__uc_simulate", _WRAPPER % function)
+    if time_limit is not None:
+        # applies to each call separately; a policy that runs over is interrupted with a
+        # JSException, so an infinite loop is reported like any other policy error
+        f.set_time_limit(time_limit)
+    return f
+
+
+# Recorded as the output for an input on which the policy threw
+class PolicyError:
+    message: str
+
+    def __init__(self, message):
+        self.message = message
+
+    def __repr__(self):
+        return f"PolicyError({self.message})"
+
+    def __eq__(self, other):
+        return isinstance(other, PolicyError) and self.message == other.message
+
+
+class SimulationReport:
+    policy_id: str
+    outputs: list
+    latencies: list[float]
+
+    def __init__(self, policy_id, outputs, latencies):
+        self.policy_id = policy_id
+        self.outputs = outputs
+        self.latencies = latencies
+
+    def __repr__(self):
+        return (
+            f"SimulationReport({self.policy_id}, n={len(self.outputs)}, "
+            f"mean={self.mean * 1000:.3f}ms, p99={self.percentile(99) * 1000:.3f}ms)"
+        )
+
+    @property
+    def mean(self) -> float:
+        return statistics.fmean(self.latencies) if self.latencies else 0
+
+    # latency (in seconds) below which p percent of evaluations completed
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return 0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    # indexes of the inputs for which this report and `other` (e.g. the same inputs run through a
+    # changed policy) produced different outputs
+    def diff(self, other: "SimulationReport") -> list[int]:
+        return [
+            i for i, (a, b) in enumerate(zip(self.outputs, other.outputs)) if a != b
+        ]
+
+
+# PolicySimulator evaluates access and transformation policy functions locally, so a policy
+# change can be checked (and load tested) against a batch of sample inputs before it's created
+# on the server. Compiled functions are cached by source, so re-running the same policy over
+# many batches only compiles it once.
+#
+#   sim = PolicySimulator()
+#   before = sim.run_access_policy(ap, contexts)
+#   after = sim.run_access_policy(changed_ap, contexts)
+#   print(before, after, before.diff(after))
+#
+# Contexts are passed to the function as-is, so they should look like what the server hands
+# the policy, e.g. {"client": {"purpose": "support"}} for ExecuteAccessor(..., {"purpose": ...}).
+# Errors thrown by a policy are recorded as that input's output rather than stopping the run, and
+# so is running for longer than time_limit seconds on one input (None for no limit).
+class PolicySimulator:
+    time_limit: float
+
+    def __init__(self, time_limit: float = 1.0):
+        self.time_limit = time_limit
+
+    def run_access_policy(
+        self, policy: AccessPolicy, contexts: list[dict], parameters: str = None
+    ) -> SimulationReport:
+        return self._run(policy, contexts, parameters)
+
+    # rows map column names to values, like the data passed to transformation policies
+    def run_transformation_policy(
+        self, policy: TransformationPolicy, rows: list[dict], parameters: str = None
+    ) -> SimulationReport:
+        return self._run(policy, rows, parameters)
+
+    def _run(self, policy, inputs: list, parameters: str) -> SimulationReport:
+        f = _compile(policy.function, self.time_limit)
+        # only reached once _compile has found quickjs
+        import quickjs
+
+        if parameters is None:
+            parameters = policy.parameters or "{}"
+
+        outputs = []
+        latencies = []
+        for i in inputs:
+            arg = ucjson.dumps(i)
+            start = time.perf_counter()
+            try:
+                result = f(arg, parameters)
+            except quickjs.JSException as e:
+                result = PolicyError(str(e))
+            latencies.append(time.perf_counter() - start)
+
+            # a policy that returns undefined leaves us with nothing to parse
+            if isinstance(result, str):
+                result = ucjson.loads(result)
+            outputs.append(result)
+
+        return SimulationReport(str(policy.id), outputs, latencies)
@@ -0,0 +1,104 @@
+import collections
+import os
+import sys
+import threading
+
+_SDK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# the SDK modules whose frames the profiler attributes samples to by default. They're matched by
+# absolute path, so other packages' client.py or models.py (e.g. requests') aren't counted.
+SDK_FILES = tuple(
+    os.path.join(_SDK_DIR, f)
+    for f in (
+        "client.py",
+        "models.py",
+        "ucjson.py",
+        "errors.py",
+        "tokencache.py",
+        "transport.py",
+        "hedge.py",
+        "metrics.py",
+    )
+)
+
+
+# SamplingProfiler periodically samples the stacks of every thread in the process and counts
+# which lines of the SDK's own modules were executing, to find hot paths (header building, JSON
+# decoding, model construction, ...) in a live worker without instrumenting it. It only reads
+# stacks, so it's cheap enough to leave running at a coarse interval.
+#
+#   profiler = SamplingProfiler(interval=0.005)
+#   profiler.start()
+#   ...
+#   profiler.stop()
+#   for (file, line, function), samples in profiler.top(10):
+#       print(f"{file}:{line} {function}: {samples}")
+class SamplingProfiler:
+    interval: float
+    files: tuple[str, ...]
+
+    def __init__(self, interval: float = 0.01, files: tuple[str, ...] = SDK_FILES):
+        self.interval = interval
+        self.files = files
+        self._paths = frozenset(os.path.abspath(f) for f in files)
+        # code filename -> basename to report it as, or None if it isn't one of ours
+        self._names = {}
+        self.samples = 0
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="userclouds-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # The n (file, line, function) locations seen in the most samples, with their counts. Each
+    # sample counts the innermost SDK frame of every thread that was inside the SDK.
+    def top(self, n: int = 10) -> list[tuple[tuple[str, int, str], int]]:
+        with self._lock:
+            return self._counts.most_common(n)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+            self.samples = 0
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            hits = []
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                while frame is not None:
+                    code = frame.f_code
+                    name = self._name(code.co_filename)
+                    if name is not None:
+                        hits.append((name, frame.f_lineno, code.co_name))
+                        break
+                    frame = frame.f_back
+
+            with self._lock:
+                self.samples += 1
+                self._counts.update(hits)
+
+    def _name(self, filename: str) -> str | None:
+        try:
+            return self._names[filename]
+        except KeyError:
+            pass
+        name = None
+        if os.path.abspath(filename) in self._paths:
+            name = os.path.basename(filename)
+        self._names[filename] = name
+        return name
@@ -0,0 +1,191 @@
+import threading
+import time
+import urllib.parse
+import weakref
+
+from client import Client
+from transport import LimitedTransport, RequestsTransport, Transport
+
+
+class _Tenant:
+    def __init__(self, url, client_id, secret, semaphore):
+        self.url = url
+        self.client_id = client_id
+        self.secret = secret
+        self.semaphore = semaphore
+        self.client = None
+        self.last_used = 0.0
+
+
+# A host's shared transport, and the number of Clients still using it
+class _Pool:
+    def __init__(self, transport: RequestsTransport):
+        self.transport = transport
+        self.clients = 0
+
+
+# ClientRegistry hands out Clients for many UserClouds tenants from one process. Tenants are
+# registered up front (which is cheap and doesn't touch the network) and a tenant's Client is
+# created the first time it's asked for. Since Clients authenticate lazily, each tenant's token
+# is fetched (and later refreshed) only when that tenant is actually used, and tokens never mix
+# between tenants.
+#
+# Clients whose tenants live on the same host share one pooled transport, so the number of open
+# connections grows with the number of hosts rather than tenants. max_concurrency caps requests
+# in flight across every tenant and tenant_concurrency caps them per tenant. Clients that haven't
+# been used for idle_ttl seconds are dropped (along with their tokens) and transparently
+# recreated on next use, and max_tenants bounds how many are kept live at once. A dropped Client
+# that the caller still holds keeps working on its host's shared pool, which is closed only once
+# no Client uses it any more.
+#
+#   registry = ClientRegistry(max_concurrency=64, tenant_concurrency=8)
+#   registry.register("acme", "https://acme.tenant.userclouds.com", client_id, client_secret)
+#   registry.get("acme").ExecuteAccessor(...)
+#
+# Any other keyword arguments (timeout, token_cache, metrics, ...) are passed to every Client.
+# With metrics, the registry reports the state of all of its pools (labeled by host) as
+# userclouds_pool_connections, and how many requests are waiting for a concurrency slot (and for
+# how long) as userclouds_requests_waiting and userclouds_request_wait_seconds.
+class ClientRegistry:
+    idle_ttl: float
+    max_tenants: int
+
+    def __init__(
+        self,
+        max_concurrency: int = None,
+        tenant_concurrency: int = None,
+        idle_ttl: float = 600,
+        max_tenants: int = None,
+        **client_kwargs,
+    ):
+        self.idle_ttl = idle_ttl
+        self.max_tenants = max_tenants
+        self._tenant_concurrency = tenant_concurrency
+        self._global = (
+            threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        )
+        # each host's pool keeps enough connections open for every request that may be in flight
+        self._pool_size = max_concurrency
+        self._client_kwargs = client_kwargs
+
+        # reentrant, since a Client being garbage collected calls _client_gone() on whatever
+        # thread drops the last reference, which may be holding the lock
+        self._lock = threading.RLock()
+        self._tenants = {}
+        self._pools = {}
+        self._next_eviction = 0.0
+
+        metrics = client_kwargs.get("metrics")
+        if metrics is not None:
+            metrics.register_gauge("userclouds_pool_connections", self._pool_stats)
+
+    def register(self, tenant: str, url: str, client_id: str, secret: str):
+        semaphore = None
+        if self._tenant_concurrency:
+            semaphore = threading.BoundedSemaphore(self._tenant_concurrency)
+        with self._lock:
+            old = self._tenants.get(tenant)
+            self._tenants[tenant] = _Tenant(url, client_id, secret, semaphore)
+            if old is not None:
+                old.client = None
+
+    def unregister(self, tenant: str):
+        with self._lock:
+            t = self._tenants.pop(tenant, None)
+            if t is not None:
+                t.client = None
+
+    def get(self, tenant: str) -> Client:
+        now = time.monotonic()
+        with self._lock:
+            t = self._tenants.get(tenant)
+            if t is None:
+                raise KeyError(f"unknown tenant {tenant!r}")
+
+            t.last_used = now
+            client = t.client
+            if client is None:
+                host = urllib.parse.urlsplit(t.url).netloc
+                pool = self._pools.get(host)
+                if pool is None:
+                    transport = RequestsTransport(pool_maxsize=self._pool_size)
+                    pool = self._pools[host] = _Pool(transport)
+                client = t.client = Client(
+                    t.url,
+                    t.client_id,
+                    t.secret,
+                    transport=self._limited(t, pool.transport),
+                    **self._client_kwargs,
+                )
+                pool.clients += 1
+                weakref.finalize(client, self._client_gone, host, pool)
+                # a new live client may have taken us over max_tenants
+                self._evict(now, force=self.max_tenants is not None)
+            else:
+                self._evict(now)
+            return client
+
+    # Number of tenants that currently have a live Client
+    def active(self) -> int:
+        with self._lock:
+            return sum(1 for t in self._tenants.values() if t.client is not None)
+
+    # Close every pool, including ones still used by Clients handed out earlier
+    def close(self):
+        with self._lock:
+            for t in self._tenants.values():
+                t.client = None
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.transport.close()
+
+    def _limited(self, t: _Tenant, transport: Transport) -> Transport:
+        # take the tenant's own slot before a global one, so a tenant at its cap can't sit on
+        # global slots that other tenants could use
+        semaphores = [s for s in (t.semaphore, self._global) if s is not None]
+        if not semaphores:
+            return transport
+        return LimitedTransport(
+            transport, *semaphores, metrics=self._client_kwargs.get("metrics")
+        )
+
+    # Called when a Client we created is garbage collected; closes its host's pool once no
+    # Client uses it
+    def _client_gone(self, host: str, pool: _Pool):
+        with self._lock:
+            pool.clients -= 1
+            if pool.clients > 0 or self._pools.get(host) is not pool:
+                return
+            del self._pools[host]
+        pool.transport.close()
+
+    def _pool_stats(self) -> dict:
+        with self._lock:
+            pools = list(self._pools.values())
+        stats = {}
+        for pool in pools:
+            stats.update(pool.transport.pool_stats())
+        return stats
+
+    # Drop clients idle for longer than idle_ttl, then the least recently used ones beyond
+    # max_tenants. Must be called with the lock held.
+    def _evict(self, now: float, force: bool = False):
+        # scanning every tenant on every get() would cost more than the clients we'd free
+        if not force and now < self._next_eviction:
+            return
+        self._next_eviction = now + min(self.idle_ttl, 60)
+
+        # dropping our reference is all it takes: a host's pool is closed by _client_gone() once
+        # no Client (ours, or one the caller still holds) uses it
+        live = [t for t in self._tenants.values() if t.client is not None]
+        for t in live:
+            if now - t.last_used > self.idle_ttl:
+                t.client = None
+
+        if self.max_tenants is not None:
+            live = [t for t in live if t.client is not None]
+            if len(live) > self.max_tenants:
+                live.sort(key=lambda t: t.last_used)
+                for t in live[: len(live) - self.max_tenants]:
+                    t.client = None
@@ -1,12 +1,11 @@
 import uuid
 
-from client import Client, Error
+from client import Client, Conflict, Error, NotFound
 from models import (
     AccessPolicy,
     Column,
     Accessor,
     Mutator,
-    APIErrorResponse,
     UserSelectorConfig,
     TransformationPolicy,
 )
@@ -22,9 +21,8 @@ url = "<REPLACE ME>"
 
 
 def recoverIDFrom409Error(e: Error) -> uuid.UUID:
-    if e.code == 409:
-        er = APIErrorResponse.from_json(e.error)
-        return er.id
+    if isinstance(e, Conflict) and e.id is not None:
+        return e.id
     raise e
 
 
@@ -171,9 +169,10 @@ function policy(data, params) {
         try:
             user = c.GetUserByExternalAlias_AdminOnly(external_alias)
             c.DeleteUser(user.id)
+        except NotFound:
+            pass
         except Error as e:
-            if e.code != 404:
-                print(f"error: {e}")
+            print(f"error: {e}")
 
         # create a user
         uid = c.CreateUser(external_alias)
@@ -0,0 +1,124 @@
+import base64
+import contextlib
+import os
+import stat
+import time
+
+import ucjson
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; the cache still works, just without locking
+    fcntl = None
+
+
+def token_expiry(token: str) -> float:
+    # Read the "exp" claim straight out of the JWT payload segment; we never verify the signature
+    # client-side, so there's no need to pull in PyJWT (and cryptography) just for this.
+    payload = token.split(".")[1]
+    payload += "=" * (-len(payload) % 4)
+    return ucjson.loads(base64.urlsafe_b64decode(payload)).get("exp", 0)
+
+
+# The cache lives in a directory only the current user can access: $XDG_RUNTIME_DIR/userclouds if
+# there is one, otherwise ~/.cache/userclouds. A fixed name in a shared directory like /tmp would
+# let other local users plant tokens or lock us out.
+def _default_path() -> str:
+    base = os.environ.get("XDG_RUNTIME_DIR") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    directory = os.path.join(base, "userclouds")
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    _check_private(os.stat(directory), directory)
+    return os.path.join(directory, "tokens.json")
+
+
+# Refuse to trust a cache (or lock) file or directory that another user owns or can write to
+def _check_private(st: os.stat_result, path: str):
+    if not hasattr(os, "getuid"):
+        return
+    if st.st_uid != os.getuid() or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(
+            f"{path} is not private to this user; refusing to use it as a token cache"
+        )
+
+
+class FileTokenCache:
+    # An opt-in, on-disk access token cache that can be shared by every process on a host using
+    # the same client ID (pre-fork worker pools, cron jobs, etc). Reads take a shared lock and
+    # refreshes take an exclusive one, so when a token is about to expire exactly one process
+    # fetches a new one and the others pick it up from the file.
+    #
+    # The cache and lock files must be owned by the current user and not writable by anyone else,
+    # otherwise PermissionError is raised rather than trusting them.
+    path: str
+    leeway: float
+
+    def __init__(self, path: str = None, leeway: float = 30):
+        if path is None:
+            path = _default_path()
+        self.path = path
+        self.leeway = leeway
+
+    def get(self, key: str) -> str | None:
+        with self._lock(exclusive=False):
+            return self._valid_token(self._read(), key)
+
+    def get_or_refresh(self, key: str, refresh) -> str:
+        token = self.get(key)
+        if token is not None:
+            return token
+
+        with self._lock(exclusive=True):
+            # someone else may have refreshed the token while we were waiting for the lock
+            entries = self._read()
+            token = self._valid_token(entries, key)
+            if token is not None:
+                return token
+
+            token = refresh()
+            if token is not None:
+                entries[key] = {"access_token": token, "expires_at": token_expiry(token)}
+                ucjson.dump_file(self.path, entries)
+            return token
+
+    def invalidate(self, key: str):
+        with self._lock(exclusive=True):
+            entries = self._read()
+            if entries.pop(key, None) is not None:
+                ucjson.dump_file(self.path, entries)
+
+    def _valid_token(self, entries: dict, key: str) -> str | None:
+        entry = entries.get(key)
+        if entry is None or entry.get("expires_at", 0) - self.leeway < time.time():
+            return None
+        return entry.get("access_token")
+
+    def _read(self) -> dict:
+        try:
+            fd = os.open(self.path, os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0))
+        except FileNotFoundError:
+            return {}
+        with os.fdopen(fd, "r") as f:
+            _check_private(os.fstat(fd), self.path)
+            try:
+                return ucjson.loads(f.read())
+            except ValueError:
+                return {}
+
+    @contextlib.contextmanager
+    def _lock(self, exclusive: bool):
+        if fcntl is None:
+            yield
+            return
+
+        path = self.path + ".lock"
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0)
+        fd = os.open(path, flags, 0o600)
+        try:
+            _check_private(os.fstat(fd), path)
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
@@ -0,0 +1,320 @@
+import abc
+import base64
+import collections
+import gzip
+import threading
+import time
+import urllib.parse
+from typing import Callable
+
+from errors import RequestTimeout, Transient
+from metrics import Metrics
+import ucjson
+
+
+# A Transport sends one HTTP request and returns the response, which needs status_code, text,
+# headers and close(). Client makes every request, including fetching access tokens, through
+# its transport, so swapping it out lets the SDK run against something other than the network.
+class Transport(abc.ABC):
+    @abc.abstractmethod
+    def request(self, method, url, headers=None, params=None, data=None, timeout=None):
+        pass
+
+    def close(self):
+        pass
+
+
+# The default transport: a pooled requests.Session, created on first use so that importing and
+# constructing a client stays cheap. Network failures are raised as Transient errors.
+#
+# pool_maxsize is how many connections are kept open per host (requests' default is 10). Size it
+# to the number of requests expected in flight at once, since connections beyond it are opened
+# for a single request and then thrown away.
+class RequestsTransport(Transport):
+    pool_maxsize: int
+
+    def __init__(self, pool_maxsize: int = None):
+        self.pool_maxsize = pool_maxsize
+        self._session = None
+        self._lock = threading.Lock()
+
+    def request(self, method, url, headers=None, params=None, data=None, timeout=None):
+        import requests
+
+        try:
+            return self._get_session().request(
+                method, url, headers=headers, params=params, data=data, timeout=timeout
+            )
+        except requests.Timeout as e:
+            raise RequestTimeout(str(e)) from e
+        except requests.ConnectionError as e:
+            raise Transient(str(e), 503) from e
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+    # Idle pooled connections per host, as a Metrics gauge callback. (Connections in use are
+    # tracked by the client as requests in flight.)
+    def pool_stats(self) -> dict:
+        stats = {}
+        session = self._session
+        if session is None:
+            return stats
+
+        for adapter in session.adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None or pool.pool is None:
+                    continue
+                idle = sum(1 for c in list(pool.pool.queue) if c is not None)
+                labels = (("host", pool.host), ("state", "idle"))
+                stats[labels] = stats.get(labels, 0) + idle
+        return stats
+
+    def _get_session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+
+                    session = requests.Session()
+                    if self.pool_maxsize:
+                        for prefix in ("https://", "http://"):
+                            adapter = requests.adapters.HTTPAdapter(
+                                pool_maxsize=self.pool_maxsize
+                            )
+                            session.mount(prefix, adapter)
+                    self._session = session
+        return self._session
+
+
+# LimitedTransport caps how many requests can be in flight through another transport at once.
+# Each request holds one slot of every semaphore it's given, so several LimitedTransports can share
+# a global semaphore while each also has its own. A request that can't get a slot within its
+# connect timeout fails with a Transient error rather than queueing indefinitely. Closing it
+# leaves the inner transport open, since that's usually shared.
+#
+# With metrics, the number of requests waiting for a slot is reported as
+# userclouds_requests_waiting and the time spent waiting as userclouds_request_wait_seconds, which
+# is where starvation of a shared pool shows up.
+class LimitedTransport(Transport):
+    metrics: Metrics
+
+    def __init__(
+        self, inner: Transport, *semaphores: threading.Semaphore, metrics: Metrics = None
+    ):
+        self.inner = inner
+        self.semaphores = semaphores
+        self.metrics = metrics
+
+    def request(self, method, url, headers=None, params=None, data=None, timeout=None):
+        wait = timeout[0] if isinstance(timeout, tuple) else timeout
+        acquired = []
+        try:
+            if self.metrics is None:
+                self._acquire(acquired, wait)
+            else:
+                self.metrics.add("userclouds_requests_waiting", 1)
+                start = time.perf_counter()
+                try:
+                    self._acquire(acquired, wait)
+                finally:
+                    self.metrics.add("userclouds_requests_waiting", -1)
+                    self.metrics.observe(
+                        "userclouds_request_wait_seconds", time.perf_counter() - start
+                    )
+            return self.inner.request(method, url, headers, params, data, timeout)
+        finally:
+            for sem in reversed(acquired):
+                sem.release()
+
+    def _acquire(self, acquired: list, wait: float):
+        for sem in self.semaphores:
+            if not sem.acquire(timeout=wait):
+                raise Transient("too many concurrent requests", 503)
+            acquired.append(sem)
+
+    # pass the shared pool's state through for metrics
+    def pool_stats(self) -> dict:
+        return getattr(self.inner, "pool_stats", dict)()
+
+
+class Response:
+    status_code: int
+    text: str
+    headers: dict
+
+    def __init__(self, status_code, text, headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+    def close(self):
+        pass
+
+
+# RecordingTransport passes requests through to another transport (the network by default) and
+# appends every request/response pair to `path`, one JSON object per line (gzipped if the path
+# ends in .gz), for ReplayTransport to serve later. Request headers aren't recorded, passwords in
+# request bodies are redacted, and access tokens in token responses are replaced with a
+# placeholder that never expires, so recordings don't contain credentials. Everything else is
+# recorded as-is, though, including user profiles in request and response bodies, so treat
+# recordings of real traffic as containing PII.
+class RecordingTransport(Transport):
+    def __init__(self, path: str, inner: Transport = None):
+        self.inner = inner or RequestsTransport()
+        self._file = _open(path, "at")
+        self._lock = threading.Lock()
+
+    def request(self, method, url, headers=None, params=None, data=None, timeout=None):
+        start = time.perf_counter()
+        r = self.inner.request(method, url, headers, params, data, timeout)
+        latency = time.perf_counter() - start
+
+        text = r.text
+        if _path(url) == "/oidc/token" and r.status_code == 200:
+            j = ucjson.loads(text)
+            j["access_token"] = PLACEHOLDER_TOKEN
+            text = ucjson.dumps(j)
+
+        entry = {
+            "method": method,
+            "path": _path(url),
+            "params": _params(params),
+            "body": _body(data),
+            "status": r.status_code,
+            "text": text,
+            "headers": _recorded_headers(r.headers),
+            "latency": round(latency, 6),
+        }
+        line = ucjson.dumps(entry) + "\n"
+        with self._lock:
+            self._file.write(line)
+        return r
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        self.inner.close()
+
+
+# ReplayTransport serves responses from a RecordingTransport file out of memory. Requests are
+# matched on method, path, query parameters and (unless match_body is False) body; when the same
+# request was recorded several times its responses are served in turn, round-robin. A request
+# with no recording raises LookupError.
+#
+# latency controls how long each response takes: None for no delay, a number of seconds, a
+# callable returning seconds (e.g. lambda: random.lognormvariate(-5, 0.5)), or "recorded" to
+# replay the latency observed when recording. A delay longer than the request's read timeout
+# raises RequestTimeout once the timeout has passed, as the network transport would.
+class ReplayTransport(Transport):
+    def __init__(
+        self,
+        path: str,
+        latency: float | Callable[[], float] | str | None = None,
+        match_body: bool = True,
+    ):
+        self.latency = latency
+        self.match_body = match_body
+        self._responses = collections.defaultdict(list)
+        self._next = collections.Counter()
+        self._lock = threading.Lock()
+
+        with _open(path, "rt") as f:
+            for line in f:
+                if line.strip():
+                    e = ucjson.loads(line)
+                    key = self._key(e["method"], e["path"], e["params"], e["body"])
+                    r = Response(e["status"], e["text"], e.get("headers"))
+                    self._responses[key].append((r, e.get("latency", 0)))
+
+    def request(self, method, url, headers=None, params=None, data=None, timeout=None):
+        key = self._key(method, _path(url), _params(params), _body(data))
+        responses = self._responses.get(key)
+        if not responses:
+            raise LookupError(f"no recorded response for {method} {_path(url)}")
+
+        with self._lock:
+            i = self._next[key]
+            self._next[key] = (i + 1) % len(responses)
+        r, recorded_latency = responses[i]
+
+        if self.latency == "recorded":
+            delay = recorded_latency
+        elif callable(self.latency):
+            delay = self.latency()
+        else:
+            delay = self.latency
+        if delay:
+            limit = timeout[1] if isinstance(timeout, tuple) else timeout
+            if limit is not None and delay > limit:
+                time.sleep(limit)
+                raise RequestTimeout(f"replayed response took longer than {limit}s")
+            time.sleep(delay)
+        return r
+
+    def _key(self, method, path, params, body) -> tuple:
+        if not self.match_body:
+            body = None
+        return (method, path, params, body)
+
+
+# an unsigned JWT whose only claim is an expiry far in the future; recordings use it in place of
+# real access tokens
+PLACEHOLDER_TOKEN = "e30.%s.replay" % base64.urlsafe_b64encode(
+    b'{"exp": 4102444800}'
+).rstrip(b"=").decode("ascii")
+
+
+# Retry-After is the only response header the client looks at
+def _recorded_headers(headers) -> dict:
+    retry_after = headers.get("Retry-After")
+    return {} if retry_after is None else {"Retry-After": retry_after}
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _path(url: str) -> str:
+    return urllib.parse.urlsplit(url).path
+
+
+def _params(params) -> str | None:
+    if not params:
+        return None
+    return urllib.parse.urlencode(sorted(params.items()))
+
+
+def _body(data) -> str | None:
+    if data is None:
+        return None
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    if isinstance(data, dict):
+        return urllib.parse.urlencode(sorted(data.items()))
+    if '"password"' in data:
+        # redacted the same way when recording and when matching, so replays still match
+        try:
+            return ucjson.dumps(_redact(ucjson.loads(data)))
+        except ValueError:
+            pass
+    return data
+
+
+# request body fields whose values are never written to a recording
+_SECRET_FIELDS = {"password"}
+
+
+def _redact(j):
+    if isinstance(j, dict):
+        return {
+            k: "<redacted>" if k in _SECRET_FIELDS else _redact(v) for k, v in j.items()
+        }
+    if isinstance(j, list):
+        return [_redact(v) for v in j]
+    return j
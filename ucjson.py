@@ -1,4 +1,6 @@
 import json
+import os
+import tempfile
 import uuid
 
 # we use this simple wrapper for json to handle UUID serialization,
@@ -17,3 +19,19 @@ def loads(s):
 
 def dumps(s):
     return json.dumps(s, default=serializer, ensure_ascii=False)
+
+
+# Write obj to path as JSON, atomically: it goes to a temp file in the same directory that is
+# fsynced and renamed into place, so readers (or a run resuming after a crash) see either the old
+# file or the new one, never a partial one. The file is only readable by the current user.
+def dump_file(path, obj):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(dumps(obj))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise